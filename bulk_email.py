@@ -1,3 +1,4 @@
+import argparse
 import os
 import time
 from email.message import EmailMessage
@@ -7,6 +8,8 @@ from dotenv import load_dotenv
 from openpyxl import load_workbook
 from mako.template import Template
 
+from bulk_mail_utils import profile_stage, start_profile, stop_profile
+
 
 load_dotenv()
 smtp_server = "smtp.gmail.com"
@@ -31,6 +34,7 @@ def send_smtp(
     count: int = -1,
     sleep_sec: int = 1,
     dry_run: bool = True,
+    profile: dict | None = None,
 ):
     msg = EmailMessage()
     msg["From"] = formataddr((sender_name, login_id))
@@ -78,13 +82,18 @@ def send_smtp(
                     f"Sending to: {i:4}: {to_name:30} {to_email:50} {att_mode}",
                     end=" ",
                 )
-                html = html_template.render(name=to_name, mode=att_mode)
-                msg.replace_header("To", f"{to_name} <{to_email}>")
-                msg.set_content(html, subtype="html")
+                with profile_stage(profile, "render"):
+                    html = html_template.render(name=to_name, mode=att_mode)
+                with profile_stage(profile, "build"):
+                    msg.replace_header("To", f"{to_name} <{to_email}>")
+                    msg.set_content(html, subtype="html")
 
                 try:
-                    server.send_message(msg)
+                    with profile_stage(profile, "send"):
+                        server.send_message(msg)
                     sent_count += 1
+                    if profile is not None:
+                        profile["messages"] += 1
                     print("Sent")
                     if sent_count == count:
                         break
@@ -104,12 +113,16 @@ def clean_name(name: str) -> str:
     return name
 
 
-def prepare_recipients_list_from_excel(fname: str) -> list[tuple[str, str, bool]]:
+def prepare_recipients_list_from_excel(
+    fname: str, profile: dict | None = None
+) -> list[tuple[str, str, bool]]:
     rec_lst = []
-    wb = load_workbook(fname)
-    ws = wb.active
-    if ws:
-        for row in ws.iter_rows(min_row=2, values_only=True):
+    with profile_stage(profile, "read"):
+        wb = load_workbook(fname)
+        ws = wb.active
+        rows = list(ws.iter_rows(min_row=2, values_only=True)) if ws else []
+    with profile_stage(profile, "clean"):
+        for row in rows:
             email = str(row[1]).strip()
             name = clean_name(str(row[2]))
             att_mode = (
@@ -120,6 +133,16 @@ def prepare_recipients_list_from_excel(fname: str) -> list[tuple[str, str, bool]
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send the meeting link email")
+    parser.add_argument(
+        "--profile",
+        default="",
+        metavar="PREFIX",
+        help="profile the run, writing PREFIX.pstats and PREFIX_memory.txt",
+    )
+    args = parser.parse_args()
+    profile = start_profile() if args.profile else None
+
     subject = "Thank you for registering for the SEA Tech Talk February 2026"
 
     recipients_list = [
@@ -129,7 +152,7 @@ if __name__ == "__main__":
         # ("asifdanwad@gmail.com", "Asif Iqbal Danwad", False),
     ]
 
-    rec_lst = prepare_recipients_list_from_excel("python_for_str_engg.xlsx")
+    rec_lst = prepare_recipients_list_from_excel("python_for_str_engg.xlsx", profile)
     recipients_list = recipients_list + rec_lst
     for rec in recipients_list:
         print(rec)
@@ -146,4 +169,7 @@ if __name__ == "__main__":
         start=1,
         count=1,
         dry_run=True,
+        profile=profile,
     )
+    if profile is not None:
+        stop_profile(profile, args.profile)
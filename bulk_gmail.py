@@ -73,8 +73,83 @@ def _(mo, recipients_fname, utils):
 
 
 @app.cell
-def _(config, df, login_id, pdf_fname, pwd, sender_name, tpl_fname, utils):
-    utils.send_bulk_emails(tpl_fname, df, 1, -1, login_id=login_id, pwd=pwd, sender_name=sender_name, subject=config["subject"], pdf_fname=pdf_fname, dry_run=False)
+def _(mo):
+    get_job, set_job = mo.state(None)
+    run_send = mo.ui.run_button(label="Start sending")
+    run_send
+    return get_job, run_send, set_job
+
+
+@app.cell
+def _(
+    config,
+    df,
+    get_job,
+    login_id,
+    mo,
+    pdf_fname,
+    pwd,
+    run_send,
+    sender_name,
+    set_job,
+    tpl_fname,
+    utils,
+):
+    mo.stop(not run_send.value, mo.md("Press **Start sending** to send in the background"))
+    mo.stop(
+        utils.send_job_running(get_job()),
+        mo.md("A send is already running. Cancel it or wait for it to finish."),
+    )
+    _tpl, _tpl_type = utils.read_template(tpl_fname)
+    set_job(
+        utils.start_send_job(
+            df,
+            lambda row: utils.tpl_render(_tpl, _tpl_type, name=row["name"]),
+            1,
+            -1,
+            login_id=login_id,
+            pwd=pwd,
+            sender_name=sender_name,
+            subject=config["subject"],
+            pdf_fname=pdf_fname,
+            dry_run=False,
+        )
+    )
+    return
+
+
+@app.cell
+def _(get_job, mo, utils):
+    pause_send = mo.ui.switch(label="Pause", on_change=lambda v: utils.pause_send_job(get_job(), v))
+    cancel_send = mo.ui.button(label="Cancel", on_click=lambda _: utils.cancel_send_job(get_job()))
+    send_refresh = mo.ui.refresh(options=["1s", "2s", "5s"], default_interval="1s")
+    mo.hstack([pause_send, cancel_send, send_refresh], justify="start")
+    return (send_refresh,)
+
+
+@app.cell
+def _(get_job, mo, send_refresh, utils):
+    send_refresh
+    _job = get_job()
+    mo.stop(_job is None)
+    utils.poll_send_job(_job)
+    _eta = "" if _job["eta"] is None else f", ETA {_job['eta']:.0f} s"
+    if _job["dry_run"]:
+        _done = f"{_job['previewed']} previewed"
+    else:
+        _done = f"{_job['sent']} sent, {_job['failed']} failed"
+    with mo.status.progress_bar(
+        total=max(_job["total"], 1),
+        title="Sending",
+        subtitle=f"{_done}, {_job['rate']:.2f} msg/s{_eta}",
+        completion_title="Cancelled" if _job["stop"].is_set() else None,
+        show_rate=False,
+        show_eta=False,
+    ) as _bar:
+        _bar.update(increment=len(_job["results"]))
+    if _job["error"]:
+        mo.output.append(mo.md(f"**{_job['error']}**"))
+    mo.output.append(mo.ui.table(_job["results"], selection=None))
     return
 
 
@@ -1,7 +1,20 @@
+import argparse
+import cProfile
+import csv
+import glob
+import hashlib
 import time
 import os
+import queue
+import threading
+import tracemalloc
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from os.path import splitext, isfile
 import tomllib
+from datetime import datetime
 from email.message import EmailMessage
 from email.utils import formataddr
 import smtplib
@@ -18,8 +31,9 @@ def read_config(fname_toml: str) -> dict:
         raise FileNotFoundError(f"File not found: {fname_toml}")
     with open(fname_toml, "rb") as f:
         config = tomllib.load(f)
-    if not isfile(config["recipients"]):
-        raise FileNotFoundError(f"Recipients file not found: {config['recipients']}")
+    for fname in expand_sources(config["recipients"]):
+        if not isfile(fname):
+            raise FileNotFoundError(f"Recipients file not found: {fname}")
     if not isfile(config["template"]):
         raise FileNotFoundError(f"Template file not found: {config['template']}")
     if not isfile(config["attachment"]):
@@ -108,15 +122,104 @@ def tpl_render(tpl: Template, tpl_type: str, **kwargs) -> str:
     return txt
 
 
+# Column names, after lower-casing and replacing spaces and hyphens by "_",
+# that are read as the canonical column
+COLUMN_ALIASES = {
+    "email": ["email", "e_mail", "email_address", "email_id", "mail"],
+    "name": ["name", "full_name", "your_name", "participant_name"],
+}
+
+
+def canonical_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Rename the first column matching an alias of each canonical column.
+
+    A column already named like the canonical column is kept and other
+    aliases of it are left as they are, so no name appears twice.
+    """
+    rename = {}
+    for canon, aliases in COLUMN_ALIASES.items():
+        if canon in df.columns:
+            continue
+        for col in df.columns:
+            key = str(col).strip().lower().replace(" ", "_").replace("-", "_")
+            if key in aliases and col not in rename:
+                rename[col] = canon
+                break
+    return df.rename(columns=rename)
+
+
+def expand_sources(sources: str | list[str]) -> list[str]:
+    """File names from a path, a glob pattern or a list of them."""
+    if isinstance(sources, str):
+        sources = [sources]
+    fnames = []
+    for src in sources:
+        if any(c in src for c in "*?["):
+            matches = sorted(glob.glob(src))
+            if not matches:
+                raise FileNotFoundError(f"No files match: {src}")
+            fnames.extend(matches)
+        else:
+            fnames.append(src)
+    return fnames
+
+
+def _read_source(
+    fname: str, usecols: list | None = None, required: list | None = None
+) -> pd.DataFrame:
+    # Top level function so that it can run in a worker process
+    df = canonical_columns(read_data_file(fname))
+    missing = [col for col in (required or []) + (usecols or []) if col not in df.columns]
+    if missing:
+        raise ValueError(f"Columns {list(dict.fromkeys(missing))} not found in {fname}")
+    if usecols:
+        df = df[[col for col in df.columns if col in usecols]]
+    return df
+
+
+def read_sources(
+    fnames: list[str], usecols: list | None = None, max_workers: int | None = None
+) -> pd.DataFrame:
+    """Read several recipients files in parallel and merge them.
+
+    Rows are deduplicated by the normalized email address, keeping the first
+    occurrence in the order of `fnames`. The "source" column holds the file
+    each row was read from. Raises ValueError if a file has no email column
+    or lacks one of `usecols`.
+    """
+    if len(fnames) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            frames = list(
+                pool.map(_read_source, fnames, repeat(usecols), repeat(["email"]))
+            )
+    else:
+        frames = [_read_source(fname, usecols, ["email"]) for fname in fnames]
+    for fname, df in zip(fnames, frames):
+        df["source"] = fname
+    df = pd.concat(frames, ignore_index=True)
+    df = df.dropna(subset=["email"])
+    keys = df["email"].map(recipient_key)
+    print(f"Read {len(df)} rows from {len(fnames)} files, {keys.nunique()} unique")
+    return df[~keys.duplicated()]
+
+
 def read_recipients_data(
-    recipients_fname: str,
+    recipients_fname: str | list[str],
     usecols: list | None = None,
     cols_dup=["email", "name"],
     cols_sort=["name"],
+    max_workers: int | None = None,
+    profile: dict | None = None,
 ) -> pd.DataFrame:
     print(recipients_fname)
-    df = read_data_file(recipients_fname, usecols=usecols)
-    df = clean_data(df, cols_dup=cols_dup, cols_sort=cols_sort)
+    fnames = expand_sources(recipients_fname)
+    with profile_stage(profile, "read"):
+        if fnames == [recipients_fname]:  # A single file as before
+            df = _read_source(recipients_fname, usecols)
+        else:
+            df = read_sources(fnames, usecols=usecols, max_workers=max_workers)
+    with profile_stage(profile, "clean"):
+        df = clean_data(df, cols_dup=cols_dup, cols_sort=cols_sort)
     # df = mangle_name(df, "name")
     # print(df)
     return df
@@ -144,11 +247,18 @@ def build_message(
     return msg
 
 
-def send_bulk_emails(
-    tpl_fname: str,
+def select_rows(df: pd.DataFrame, start: int = 1, count: int = -1) -> pd.DataFrame:
+    """Rows `start` to `start + count - 1` of `df` (1-based, all rows if `count` < 0)."""
+    start = max(start, 1)
+    if count < 0:
+        count = len(df)
+    last = min(start + count - 1, len(df))
+    return df.iloc[start - 1 : last]
+
+
+def send_rows(
     df: pd.DataFrame,
-    start: int = 1,
-    count: int = -1,
+    render: Callable[[pd.Series], str],
     login_id: str = "",
     pwd: str = "",
     sender_name: str = "",
@@ -156,27 +266,42 @@ def send_bulk_emails(
     pdf_fname: str = "",
     delay: float = 0.5,
     dry_run: bool = True,
-) -> None:
-    tpl, tpl_type = read_template(tpl_fname)
+    smtp_host: str = "smtp.gmail.com",
+    smtp_port: int = 587,
+    use_tls: bool = True,
+    ledger_fname: str = "",
+    shard: str = "",
+    index_fname: str = "",
+    batch_size: int = 1,
+    profile: dict | None = None,
+    first_row: int = 1,
+    wait: Callable[[float], object] = time.sleep,
+) -> Iterator[dict]:
+    """Send to every row of `df`, yielding a result dict per recipient.
 
-    i = 0
-    if i < 0:
-        return
-    elif count < 0:
-        count = len(df)
-    last = min(start + count - 1, len(df))
-    sent_count = 0
+    This is the send loop of send_bulk_emails() and start_send_job(). A result
+    has the row number (counting from `first_row`), name, email, status
+    ("sent", "error" or "dry run"), error and the number of the SMTP
+    transaction. Results are written to the ledger and sent recipients to the
+    key index before they are yielded. `wait(delay)` is called after each
+    transaction.
+    """
+    rows = enumerate((row for _, row in df.iterrows()), start=first_row)
+    batches = batch_identical(rows, lambda item: render(item[1]), batch_size)
     if dry_run:
-        for _, row in df.iterrows():
-            i += 1
-            if i >= start and i <= last:
-                html = tpl_render(tpl, tpl_type, name=row["name"])
-                start_portion, _, _ = html.partition("</p>")
-                print(f"{row['name']} <{row['email']}>")
-                sent_count += 1
-        print(f"Total emails that will be sent: {sent_count}")
+        for n, (_, batch) in enumerate(batches, start=1):
+            for i, row in batch:
+                yield {
+                    "row": i,
+                    "name": row["name"],
+                    "email": row["email"],
+                    "status": "dry run",
+                    "error": "",
+                    "transaction": n,
+                }
         return
-    else:
+
+    with profile_stage(profile, "read"):
         if isfile(pdf_fname):
             with open(pdf_fname, "rb") as f:
                 pdf_bytes = f.read()
@@ -184,64 +309,633 @@ def send_bulk_emails(
         else:
             print(f"Attachment {pdf_fname} not found. Continuing without attachment.")
             pdf_bytes = b""
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
+    with smtplib.SMTP(smtp_host, smtp_port) as server:
+        if use_tls:  # Local test servers accept plain, unauthenticated SMTP
             server.starttls()
             server.login(login_id, pwd)
-            for _, row in df.iterrows():
-                i += 1
-                if i >= start and i <= last:
-                    html = tpl_render(tpl, tpl_type, name=row["name"])
-                    msg = build_message(
-                        sender_name=sender_name,
-                        sender_email=login_id,
-                        recipient_name=row["name"],
-                        recipient_email=row["email"],
-                        subject=subject,
-                        body=html,
-                        pdf_fname=pdf_fname,
-                        pdf_bytes=pdf_bytes,
-                    )
-                    try:
-                        server.send_message(msg)
-                        print(f"{row['name']} <{row['email']}>")
-                        sent_count += 1
-                        time.sleep(delay)
-                    except Exception as e:
-                        print(f"Error sending message: {e}")
-            print(f"Total emails sent: {sent_count}")
-            # Here you would add the actual email sending logic using an email library like smtplib or a service API
+        for n, (html, batch) in enumerate(batches, start=1):
+            if len(batch) == 1:
+                to_name, to_email = batch[0][1]["name"], batch[0][1]["email"]
+                to_addrs = None
+            else:  # Identical message, recipients only in the envelope (Bcc)
+                to_name, to_email = sender_name, login_id
+                to_addrs = [row["email"] for _, row in batch]
+            with profile_stage(profile, "build"):
+                msg = build_message(
+                    sender_name=sender_name,
+                    sender_email=login_id,
+                    recipient_name=to_name,
+                    recipient_email=to_email,
+                    subject=subject,
+                    body=html,
+                    pdf_fname=pdf_fname,
+                    pdf_bytes=pdf_bytes,
+                )
+            try:
+                with profile_stage(profile, "send"):
+                    refused = server.send_message(msg, to_addrs=to_addrs)
+            except Exception as e:
+                refused = {row["email"]: e for _, row in batch}
+            results = []
+            for i, row in batch:
+                status, error = "sent", ""
+                if row["email"] in refused:
+                    status, error = "error", str(refused[row["email"]])
+                else:
+                    if profile is not None:
+                        profile["messages"] += 1
+                    if index_fname:
+                        append_key_index(index_fname, [row["email"]])
+                if ledger_fname:
+                    append_ledger(ledger_fname, row, status, error, shard)
+                results.append(
+                    {
+                        "row": i,
+                        "name": row["name"],
+                        "email": row["email"],
+                        "status": status,
+                        "error": error,
+                        "transaction": n,
+                    }
+                )
+            yield from results
+            wait(delay)
+
+
+def send_bulk_emails(
+    tpl_fname: str,
+    df: pd.DataFrame,
+    start: int = 1,
+    count: int = -1,
+    login_id: str = "",
+    pwd: str = "",
+    sender_name: str = "",
+    subject: str = "",
+    pdf_fname: str = "",
+    delay: float = 0.5,
+    dry_run: bool = True,
+    smtp_host: str = "smtp.gmail.com",
+    smtp_port: int = 587,
+    use_tls: bool = True,
+    ledger_fname: str = "",
+    shard: str = "",
+    index_fname: str = "",
+    batch_size: int = 1,
+    profile: dict | None = None,
+) -> None:
+    with profile_stage(profile, "read"):
+        tpl, tpl_type = read_template(tpl_fname)
+
+    def render(row: pd.Series) -> str:
+        with profile_stage(profile, "render"):
+            return tpl_render(tpl, tpl_type, name=row["name"])
+
+    sent_count = 0
+    transactions = 0
+    for result in send_rows(
+        select_rows(df, start, count),
+        render,
+        login_id=login_id,
+        pwd=pwd,
+        sender_name=sender_name,
+        subject=subject,
+        pdf_fname=pdf_fname,
+        delay=delay,
+        dry_run=dry_run,
+        smtp_host=smtp_host,
+        smtp_port=smtp_port,
+        use_tls=use_tls,
+        ledger_fname=ledger_fname,
+        shard=shard,
+        index_fname=index_fname,
+        batch_size=batch_size,
+        profile=profile,
+        first_row=max(start, 1),
+    ):
+        transactions = result["transaction"]
+        if result["status"] == "error":
+            print(f"Error sending to {result['email']}: {result['error']}")
+        else:
+            print(f"{result['name']} <{result['email']}>")
+            sent_count += 1
+    if dry_run:
+        print(f"Total emails that will be sent: {sent_count}")
+        if batch_size > 1:
+            print(f"SMTP transactions: {transactions}")
+    else:
+        print(f"Total emails sent: {sent_count} in {transactions} SMTP transactions")
+
+
+def batch_identical[T](
+    rows: Iterable[T], render: Callable[[T], str], batch_size: int = 1
+) -> Iterator[tuple[str, list[T]]]:
+    """Render each row and group rows whose rendered body is identical.
+
+    Yields (body, rows) pairs of at most `batch_size` rows each. Each pair can
+    go out as one message with all the rows as envelope recipients. A batch is
+    yielded as soon as it is full. At most `batch_size` rows wait for a batch
+    to fill: beyond that the oldest group goes out as it is. Memory stays
+    bounded, and rows of a personalised template go out in order, a few rows
+    behind rendering. With `batch_size` 1 each row is rendered and yielded in
+    turn.
+    """
+    if batch_size <= 1:
+        for row in rows:
+            yield render(row), [row]
+        return
+    bodies: dict[str, str] = {}
+    groups: dict[str, list[T]] = {}  # Pending rows by digest, oldest group first
+    pending = 0
+    for row in rows:
+        html = render(row)
+        digest = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        if digest not in groups:
+            groups[digest] = []
+            bodies[digest] = html
+        groups[digest].append(row)
+        pending += 1
+        if len(groups[digest]) < batch_size:
+            if pending < batch_size:
+                continue
+            digest = next(iter(groups))
+        group = groups.pop(digest)
+        pending -= len(group)
+        yield bodies.pop(digest), group
+    for digest, group in groups.items():
+        yield bodies[digest], group
+
+
+def normalize_email(email) -> str:
+    return str(email).strip().lower()
+
+
+def recipient_key(email) -> str:
+    """Stable hash of the normalized email address, used to identify a recipient."""
+    return hashlib.sha1(normalize_email(email).encode("utf-8")).hexdigest()
+
+
+def shard_of(email, n_shards: int) -> int:
+    """Shard (1 to `n_shards`) that the recipient belongs to.
+
+    Depends only on the email address, so every host computes the same plan
+    from the same recipients file regardless of row order.
+    """
+    return int(recipient_key(email), 16) % n_shards + 1
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """Parse a shard specification "i/N" into (i, N), with 1 <= i <= N."""
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N, e.g. 2/4")
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError(f"Invalid shard {spec!r}, expected 1 <= i <= N")
+    return i, n
+
+
+def read_key_index(index_fname: str) -> set[str]:
+    """Recipient keys already recorded in a campaign's key index file."""
+    if not isfile(index_fname):
+        return set()
+    with open(index_fname, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def append_key_index(index_fname: str, emails) -> None:
+    with open(index_fname, "a", encoding="utf-8") as f:
+        f.writelines(f"{recipient_key(email)}\n" for email in emails)
+
+
+def delta_recipients(df: pd.DataFrame, index: set[str]) -> pd.DataFrame:
+    """Recipients whose key is not in `index`, i.e. new since the last run.
+
+    Each row is looked up in the `index` set by its recipient_key(), so the
+    cost does not depend on how many earlier snapshots there were. Repeated
+    addresses in the snapshot are sent to once.
+    """
+    keys = df["email"].map(recipient_key)
+    new = ~keys.isin(index) & ~keys.duplicated()
+    return df[new]
+
+
+def plan_shards(df: pd.DataFrame, n_shards: int) -> list[pd.DataFrame]:
+    """Split recipients into `n_shards` disjoint DataFrames by shard_of() the email."""
+    shards = df["email"].map(lambda email: shard_of(email, n_shards))
+    return [df[shards == i] for i in range(1, n_shards + 1)]
+
+
+LEDGER_COLS = ["time", "shard", "key", "email", "name", "status", "error"]
+
+
+def append_ledger(
+    ledger_fname: str, row: pd.Series, status: str, error: str = "", shard: str = ""
+) -> None:
+    # One line per message, written as soon as it is sent so that an
+    # interrupted run still leaves an accurate ledger.
+    new_file = not isfile(ledger_fname)
+    with open(ledger_fname, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(LEDGER_COLS)
+        writer.writerow(
+            [
+                datetime.now().isoformat(sep=" ", timespec="microseconds"),
+                shard,
+                recipient_key(row["email"]),
+                row["email"],
+                row["name"],
+                status,
+                error,
+            ]
+        )
+
+
+def merge_ledgers(
+    ledger_fnames: list[str], recipients: pd.DataFrame | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Combine shard ledgers into one campaign report.
+
+    Returns (report, duplicates, gaps). The report has the last ledger entry of
+    each recipient. Duplicates are recipients sent more than once. Gaps are
+    recipients in `recipients` that have no "sent" entry in any ledger.
+    """
+    frames = []
+    for fname in ledger_fnames:
+        ledger = pd.read_csv(fname, dtype=str, keep_default_na=False)
+        ledger["ledger"] = fname
+        frames.append(ledger)
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=LEDGER_COLS + ["ledger"])
+
+    sent = df[df["status"] == "sent"]
+    # A stable sort keeps entries with equal times in ledger and line order
+    duplicates = sent[sent.duplicated(subset="key", keep=False)].sort_values(
+        by=["key", "time"], kind="stable"
+    )
+    report = df.sort_values(by="time", kind="stable").drop_duplicates(
+        subset="key", keep="last"
+    )
+
+    if recipients is None:
+        gaps = pd.DataFrame(columns=["email", "name"])
+    else:
+        keys = recipients["email"].map(recipient_key)
+        gaps = recipients[~keys.isin(set(sent["key"]))]
+
+    print(f"Ledgers: {len(ledger_fnames)}, entries: {len(df)}")
+    failed = report[report["status"] != "sent"]
+    print(f"Recipients sent: {sent['key'].nunique()}, failed: {len(failed)}")
+    print(f"Duplicates: {duplicates['key'].nunique()}, gaps: {len(gaps)}")
+    return report, duplicates, gaps
+
+
+def start_profile() -> dict:
+    """Start profiling a run with cProfile and tracemalloc.
+
+    Pass the returned dict as `profile` to read_recipients_data() and
+    send_bulk_emails(), then call stop_profile(). "messages" counts the
+    messages sent successfully.
+    """
+    profile = {"stages": {}, "messages": 0, "profiler": cProfile.Profile()}
+    tracemalloc.start()
+    profile["profiler"].enable()
+    return profile
+
+
+@contextmanager
+def profile_stage(profile: dict | None, stage: str):
+    """Add the time and memory used by the enclosed code to a named stage."""
+    if profile is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    mem0 = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        st = profile["stages"].setdefault(
+            stage, {"calls": 0, "seconds": 0.0, "net_bytes": 0}
+        )
+        st["calls"] += 1
+        st["seconds"] += time.perf_counter() - t0
+        st["net_bytes"] += tracemalloc.get_traced_memory()[0] - mem0
+
+
+def stop_profile(profile: dict, prefix: str = "profile", top_n: int = 20) -> dict:
+    """Stop profiling and write the reports.
+
+    Writes the cProfile statistics to `prefix`.pstats (read them with the
+    pstats module or snakeviz) and the time and memory per stage with the
+    top `top_n` allocation sites to `prefix`_memory.txt. Returns a summary
+    including the peak memory per 1000 messages.
+    """
+    profile["profiler"].disable()
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    profile["profiler"].dump_stats(f"{prefix}.pstats")
+
+    messages = profile["messages"]
+    peak_per_1k = peak / messages * 1000 if messages else 0.0
+    lines = [
+        f"Messages: {messages}",
+        f"Peak memory: {peak / 1024:.1f} KiB, {peak_per_1k / 1024:.1f} KiB per 1000 messages",
+        "",
+        f"{'Stage':10} {'Calls':>8} {'Seconds':>10} {'Net KiB':>10}",
+    ]
+    for stage, st in profile["stages"].items():
+        lines.append(
+            f"{stage:10} {st['calls']:8} {st['seconds']:10.3f} {st['net_bytes'] / 1024:10.1f}"
+        )
+    lines += ["", f"Top {top_n} allocation sites:"]
+    lines += [str(stat) for stat in snapshot.statistics("lineno")[:top_n]]
+    Path(f"{prefix}_memory.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print("\n".join(lines[:4 + len(profile["stages"])]))
+    print(f"Profile written to {prefix}.pstats and {prefix}_memory.txt")
+    return {
+        "messages": messages,
+        "peak_bytes": peak,
+        "peak_bytes_per_1k": peak_per_1k,
+        "stages": profile["stages"],
+    }
+
+
+def _send_job(job: dict, results: Iterator[dict]) -> None:
+    # Runs in the worker thread. Every result of send_rows() is put on
+    # job["progress"], the caller drains it with poll_send_job(). None marks
+    # the end of the job. Pause and cancel take effect between recipients.
+    progress, stop, pause = job["progress"], job["stop"], job["pause"]
+    try:
+        for result in results:
+            progress.put(result)
+            while pause.is_set() and not stop.is_set():
+                stop.wait(0.2)
+            if stop.is_set():
+                break
+    except Exception as e:
+        job["error"] = f"Sending stopped: {e}"
+    finally:
+        results.close()
+        progress.put(None)
+
+
+def start_send_job(
+    df: pd.DataFrame,
+    render: Callable[[pd.Series], str],
+    start: int = 1,
+    count: int = -1,
+    login_id: str = "",
+    pwd: str = "",
+    sender_name: str = "",
+    subject: str = "",
+    pdf_fname: str = "",
+    delay: float = 0.5,
+    dry_run: bool = True,
+    smtp_host: str = "smtp.gmail.com",
+    smtp_port: int = 587,
+    use_tls: bool = True,
+    ledger_fname: str = "",
+    shard: str = "",
+    index_fname: str = "",
+    batch_size: int = 1,
+) -> dict:
+    """Send to the selected rows of `df` with send_rows() in a background thread.
+
+    `render(row)` returns the HTML body for a recipient row. The returned job
+    dict is passed to poll_send_job(), pause_send_job() and cancel_send_job().
+    """
+    rows = select_rows(df, start, count)
+    job = {
+        "total": len(rows),
+        "dry_run": dry_run,
+        "results": [],
+        "sent": 0,
+        "failed": 0,
+        "previewed": 0,
+        "rate": 0.0,
+        "eta": None,
+        "done": False,
+        "error": "",
+        "started": time.monotonic(),
+        "progress": queue.Queue(),
+        "stop": threading.Event(),
+        "pause": threading.Event(),
+    }
+    results = send_rows(
+        rows,
+        render,
+        login_id=login_id,
+        pwd=pwd,
+        sender_name=sender_name,
+        subject=subject,
+        pdf_fname=pdf_fname,
+        delay=delay,
+        dry_run=dry_run,
+        smtp_host=smtp_host,
+        smtp_port=smtp_port,
+        use_tls=use_tls,
+        ledger_fname=ledger_fname,
+        shard=shard,
+        index_fname=index_fname,
+        batch_size=batch_size,
+        first_row=max(start, 1),
+        wait=job["stop"].wait,  # Cancelling does not wait out the delay
+    )
+    job["thread"] = threading.Thread(target=_send_job, args=(job, results), daemon=True)
+    job["thread"].start()
+    return job
+
+
+def send_job_running(job: dict | None) -> bool:
+    return job is not None and job["thread"].is_alive()
+
+
+def poll_send_job(job: dict, timeout: float = 0.0) -> list[dict]:
+    """Move finished rows from the job's progress queue into job["results"].
+
+    Waits up to `timeout` seconds for the first result. Updates the sent,
+    failed and (in a dry run) previewed counts, throughput (recipients per
+    second) and ETA (seconds), and returns the newly finished rows.
+    """
+    new = []
+    block = timeout > 0
+    while not job["done"]:
+        try:
+            item = job["progress"].get(block=block, timeout=timeout if block else None)
+        except queue.Empty:
+            break
+        block = False
+        if item is None:  # End of job marker
+            job["done"] = True
+        else:
+            new.append(item)
+
+    job["results"].extend(new)
+    counts = {"sent": "sent", "error": "failed", "dry run": "previewed"}
+    for r in new:
+        job[counts[r["status"]]] += 1
+    finished = len(job["results"])
+    elapsed = time.monotonic() - job["started"]
+    job["rate"] = finished / elapsed if elapsed > 0 else 0.0
+    if job["done"]:
+        job["eta"] = 0.0
+    elif job["rate"] > 0:
+        job["eta"] = (job["total"] - finished) / job["rate"]
+    return new
+
+
+def pause_send_job(job: dict | None, paused: bool = True) -> None:
+    if job is None:
+        return
+    if paused:
+        job["pause"].set()
+    else:
+        job["pause"].clear()
+
+
+def cancel_send_job(job: dict | None) -> None:
+    if job is not None:
+        job["stop"].set()
 
 
 if __name__ == "__main__":
-    config = read_config("config.toml")
+    parser = argparse.ArgumentParser(description="Send bulk email as set up in config.toml")
+    parser.add_argument("--config", default="config.toml", help="configuration file")
+    parser.add_argument("--shard", default="", help="send only shard i of N, e.g. 2/4")
+    parser.add_argument("--ledger", default="", help="delivery ledger CSV file")
+    parser.add_argument(
+        "--merge", nargs="+", metavar="LEDGER", help="merge shard ledgers and exit"
+    )
+    parser.add_argument("--report", default="campaign_report.csv", help="merged report file")
+    parser.add_argument(
+        "--all", action="store_true", help="send to all recipients, not only row 4"
+    )
+    parser.add_argument(
+        "--delta",
+        default="",
+        metavar="INDEX",
+        help="send only to recipients not yet in this campaign key index file",
+    )
+    parser.add_argument(
+        "--mark-sent",
+        action="store_true",
+        help="with --delta, add the new recipients to the index without sending",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="send identical messages to up to this many recipients at once (Bcc)",
+    )
+    parser.add_argument(
+        "--profile",
+        default="",
+        metavar="PREFIX",
+        help="profile the run, writing PREFIX.pstats and PREFIX_memory.txt",
+    )
+    parser.add_argument(
+        "--max-kib-per-1k",
+        type=float,
+        default=0.0,
+        help="with --profile, exit with status 1 if peak memory per 1000 messages exceeds this",
+    )
+    parser.add_argument("--smtp-host", default="smtp.gmail.com")
+    parser.add_argument("--smtp-port", type=int, default=587)
+    parser.add_argument(
+        "--no-tls", action="store_true", help="plain SMTP without STARTTLS or login"
+    )
+    args = parser.parse_args()
+    if args.mark_sent and not args.delta:
+        parser.error("--mark-sent requires --delta")
+
+    config = read_config(args.config)
     print(config)
     # fname = config["recipients"]
     # tpl_fname = config["template"]
 
+    if args.merge:
+        df = read_recipients_data(
+            config["recipients"], usecols=["email", "name"], cols_dup=[], cols_sort=[]
+        )
+        report, duplicates, gaps = merge_ledgers(args.merge, df)
+        report.to_csv(args.report, index=False)
+        print(f"Campaign report written to {args.report}")
+        if len(duplicates):
+            print(duplicates[["email", "name", "shard", "ledger"]])
+        if len(gaps):
+            print(gaps)
+        raise SystemExit(1 if len(duplicates) or len(gaps) else 0)
+
     load_dotenv()
-    config["login_id"] = os.getenv("LOGIN_ID")
-    config["sender_name"] = os.getenv("SENDER_NAME")
-    config["password"] = os.getenv("APP_PASSWORD")
+    config["login_id"] = os.getenv("LOGIN_ID", "")
+    config["sender_name"] = os.getenv("SENDER_NAME", "")
+    config["password"] = os.getenv("APP_PASSWORD", "")
     print(
         f"Login ID: {config['login_id']}, Sender Name: {config['sender_name']}, Password: {'*' * len(config['password']) if config['password'] else None}"
     )
 
+    profile = start_profile() if args.profile else None
     df = read_recipients_data(
-        config["recipients"], usecols=["email", "name"], cols_dup=[], cols_sort=[]
+        config["recipients"],
+        usecols=["email", "name"],
+        cols_dup=[],
+        cols_sort=[],
+        profile=profile,
     )
     # df["mode"] = df["att_mode"].apply(lambda x: x.strip().lower().startswith("online"))
     # df = df[["email", "name", "mode"]].copy()
+    start, count = 4, 1
+    if args.all:
+        start, count = 1, -1
+    ledger_fname = args.ledger
+    if args.delta:
+        df = delta_recipients(df, read_key_index(args.delta))
+        start, count = 1, -1
+        print(f"Delta: {len(df)} new recipients not in {args.delta}")
+        if args.mark_sent:
+            append_key_index(args.delta, df["email"])
+            print(f"Added {len(df)} recipients to {args.delta} without sending")
+            raise SystemExit(0)
+    if args.shard:
+        i, n = parse_shard(args.shard)
+        df = plan_shards(df, n)[i - 1]
+        start, count = 1, -1
+        ledger_fname = ledger_fname or f"ledger_shard{i}of{n}.csv"
+        print(f"Shard {i}/{n}: {len(df)} recipients, ledger {ledger_fname}")
     print(df)
-    if config["login_id"] and config["password"] and config["sender_name"]:
+    # A plain local test server (--no-tls) needs no login
+    if args.no_tls or (
+        config["login_id"] and config["password"] and config["sender_name"]
+    ):
         send_bulk_emails(
             config["template"],
             df,
-            4,
-            1,
+            start,
+            count,
             login_id=config["login_id"],
             pwd=config["password"],
             sender_name=config["sender_name"],
             subject=config["subject"],
             pdf_fname=config["attachment"],
             dry_run=False,
+            smtp_host=args.smtp_host,
+            smtp_port=args.smtp_port,
+            use_tls=not args.no_tls,
+            ledger_fname=ledger_fname,
+            shard=args.shard,
+            index_fname=args.delta,
+            batch_size=args.batch_size,
+            profile=profile,
         )
+    if profile is not None:
+        summary = stop_profile(profile, args.profile)
+        if args.max_kib_per_1k:
+            if summary["messages"] == 0:
+                print("No messages were sent, peak memory per message is unknown")
+                raise SystemExit(1)
+            if summary["peak_bytes_per_1k"] > args.max_kib_per_1k * 1024:
+                print(f"Peak memory per 1000 messages exceeds {args.max_kib_per_1k} KiB")
+                raise SystemExit(1)
@@ -155,78 +155,101 @@ def _(Path, fname_recipients, mo, pd):
     return (df,)
 
 
+@app.cell
+def _(mo):
+    get_job, set_job = mo.state(None)
+    return get_job, set_job
+
+
 @app.cell
 def _(mo):
     send_bulk = mo.ui.checkbox(label="Send bulk email")
     send1 = mo.ui.number(label="First:", start=1)
     count = mo.ui.number(label="Count:", value=1, start=-1)
-    mo.hstack([send_bulk, send1, count])
-    return count, send1, send_bulk
+    run_send = mo.ui.run_button(label="Start")
+    mo.hstack([send_bulk, send1, count, run_send])
+    return count, run_send, send1, send_bulk
 
 
 @app.cell
 def _(
     count,
     df,
+    get_job,
     login_id,
     md_fmt,
+    mo,
     pwd,
+    run_send,
     send1,
     send_bulk,
     sender_name,
-    smtplib,
+    set_job,
     subject,
-    time,
     tpl_render,
     tpl_txt,
     utils,
 ):
-    i1 = int(send1.value)
-    _count = int(count.value)
-    if _count > 0:
-        _send2 = i1 +  _count - 1
-    else:
-        _send2 = i1 + len(df) - 1
-    i2 = min(_send2, len(df))
-    r = range(i1-1, i2)
-    # print(r)
-
-    if send_bulk.value:
-        print(subject.value)
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as _server:
-            _server.starttls()
-            _server.login(login_id, pwd)
-            print("Connected to SMTP server")
-            for _i in range(i1 - 1, i2):
-                _name = df.iloc[_i]["name"]
-                _email = df.iloc[_i]["email"]
-                try:
-                    # _name = test_name.value
-                    # _email = test_email.value
-                    print(f"{_i+1:4d}: {_name} <{_email}>", end="...")
-                    _html = tpl_render(tpl_txt, md_fmt, name=_name, email=_email)
-                    _msg = utils.build_message(
-                        sender_name=sender_name,
-                        sender_email=login_id,
-                        recipient_name=_name,
-                        recipient_email=_email,
-                        subject=subject.value, body=_html
-                    )
-                    _server.send_message(_msg)
-                    time.sleep(0.5)
-                    print()
-                except Exception as e:
-                    print(f"Error sending message: {e}")
-            print("Disconnected from SMTP server")
-    else:
+    # Sending runs in a background thread so the notebook stays usable.
+    # The job is kept in mo.state, so re-running this cell (e.g. when the
+    # template preview changes) does not lose track of a running send.
+    mo.stop(not run_send.value, mo.md("Press **Start** to begin sending"))
+    mo.stop(
+        utils.send_job_running(get_job()),
+        mo.md("A send is already running. Cancel it or wait for it to finish."),
+    )
+    _tpl_txt, _md_fmt = tpl_txt, md_fmt
+    if not send_bulk.value:
         print("Dry run. Emails are not being sent")
-        print(f"Subject: {subject.value}")
-        for _i in range(i1 - 1, i2):
-            # print(_i+1)
-            _name = df.iloc[_i]["name"]
-            _email = df.iloc[_i]["email"]
-            print(f"{_i+1:4d}: {_name} <{_email}>")
+    print(f"Subject: {subject.value}")
+    set_job(
+        utils.start_send_job(
+            df,
+            lambda row: tpl_render(_tpl_txt, _md_fmt, name=row["name"], email=row["email"]),
+            start=int(send1.value),
+            count=int(count.value),
+            login_id=login_id,
+            pwd=pwd,
+            sender_name=sender_name,
+            subject=subject.value,
+            dry_run=not send_bulk.value,
+        )
+    )
+    return
+
+
+@app.cell
+def _(get_job, mo, utils):
+    pause_send = mo.ui.switch(label="Pause", on_change=lambda v: utils.pause_send_job(get_job(), v))
+    cancel_send = mo.ui.button(label="Cancel", on_click=lambda _: utils.cancel_send_job(get_job()))
+    send_refresh = mo.ui.refresh(options=["1s", "2s", "5s"], default_interval="1s")
+    mo.hstack([pause_send, cancel_send, send_refresh], justify="start")
+    return (send_refresh,)
+
+
+@app.cell
+def _(get_job, mo, send_refresh, utils):
+    send_refresh
+    _job = get_job()
+    mo.stop(_job is None)
+    utils.poll_send_job(_job)
+    _eta = "" if _job["eta"] is None else f", ETA {_job['eta']:.0f} s"
+    if _job["dry_run"]:
+        _done = f"{_job['previewed']} previewed"
+    else:
+        _done = f"{_job['sent']} sent, {_job['failed']} failed"
+    with mo.status.progress_bar(
+        total=max(_job["total"], 1),
+        title="Dry run" if _job["dry_run"] else "Sending",
+        subtitle=f"{_done}, {_job['rate']:.2f} msg/s{_eta}",
+        completion_title="Cancelled" if _job["stop"].is_set() else None,
+        show_rate=False,
+        show_eta=False,
+    ) as _bar:
+        _bar.update(increment=len(_job["results"]))
+    if _job["error"]:
+        mo.output.append(mo.md(f"**{_job['error']}**"))
+    mo.output.append(mo.ui.table(_job["results"], selection=None))
     return
 
 
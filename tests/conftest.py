@@ -0,0 +1,86 @@
+import socketserver
+import threading
+
+import pytest
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough of SMTP for smtplib: no TLS, no AUTH. Recipients whose
+    # address starts with "refused" are rejected at RCPT TO.
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self) -> None:
+        self.reply("220 localhost test SMTP server")
+        rcpts = []
+        while line := self.rfile.readline():
+            cmd = line.decode("utf-8").strip()
+            verb = cmd.split(" ", 1)[0].split(":", 1)[0].upper()
+            if verb in ("EHLO", "HELO", "NOOP"):
+                self.reply("250 localhost")
+            elif verb in ("MAIL", "RSET"):
+                rcpts = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                addr = cmd.split(":", 1)[1].strip().strip("<>")
+                if addr.startswith("refused"):
+                    self.reply("550 No such user")
+                else:
+                    rcpts.append(addr)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b""
+                while (chunk := self.rfile.readline()) not in (b".\r\n", b""):
+                    data += chunk
+                if not self.server.keep_data:
+                    data = len(data)
+                with self.server.lock:
+                    self.server.messages.append((rcpts, data))
+                rcpts = []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("502 Command not implemented")
+
+
+@pytest.fixture
+def smtp_sink():
+    """A local SMTP server. Yields it, with a list of (recipients, data) in `messages`.
+
+    Set `keep_data` to False to record only the length of each message.
+    """
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.keep_data = True
+    server.lock = threading.Lock()
+    server.host, server.port = server.server_address
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def campaign(tmp_path, monkeypatch):
+    """A config.toml, template and recipients file in a temporary directory."""
+    (tmp_path / "welcome.md").write_text("Dear ${name},\n\nWelcome!\n", encoding="utf-8")
+    (tmp_path / "recipients.csv").write_text(
+        "email,name\n" + "".join(f"user{i}@example.org,User {i}\n" for i in range(30)),
+        encoding="utf-8",
+    )
+    (tmp_path / "config.toml").write_text(
+        'template = "welcome.md"\n'
+        'recipients = "recipients.csv"\n'
+        'subject = "Welcome"\n'
+        'attachment = ""\n',
+        encoding="utf-8",
+    )
+    for var in ("LOGIN_ID", "SENDER_NAME", "APP_PASSWORD"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
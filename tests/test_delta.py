@@ -0,0 +1,89 @@
+import subprocess
+import sys
+
+import pandas as pd
+
+import bulk_mail_utils as utils
+
+
+def snapshot(emails: list[str]) -> pd.DataFrame:
+    return pd.DataFrame({"email": emails, "name": [f"User {e}" for e in emails]})
+
+
+def test_new_rows_between_snapshots(tmp_path):
+    index = str(tmp_path / "welcome.keys")
+    first = snapshot(["a@x.org", "b@x.org"])
+    utils.append_key_index(index, first["email"])
+    second = snapshot(["a@x.org", "c@x.org", "b@x.org", "d@x.org"])
+    new = utils.delta_recipients(second, utils.read_key_index(index))
+    assert new["email"].tolist() == ["c@x.org", "d@x.org"]
+
+
+def test_keys_ignore_case_and_spaces(tmp_path):
+    index = str(tmp_path / "welcome.keys")
+    utils.append_key_index(index, ["Alice@Example.org"])
+    new = utils.delta_recipients(
+        snapshot([" alice@example.org ", "ALICE@EXAMPLE.ORG", "bob@example.org"]),
+        utils.read_key_index(index),
+    )
+    assert new["email"].tolist() == ["bob@example.org"]
+
+
+def test_duplicates_in_a_snapshot_are_sent_once():
+    new = utils.delta_recipients(snapshot(["a@x.org", "b@x.org", "A@x.org "]), set())
+    assert new["email"].tolist() == ["a@x.org", "b@x.org"]
+
+
+def test_missing_index_is_empty(tmp_path):
+    assert utils.read_key_index(str(tmp_path / "none.keys")) == set()
+
+
+def test_failed_sends_stay_out_of_the_index(tmp_path, smtp_sink):
+    tpl = tmp_path / "welcome.md"
+    tpl.write_text("Dear ${name},\n", encoding="utf-8")
+    index = str(tmp_path / "welcome.keys")
+    utils.send_bulk_emails(
+        str(tpl),
+        snapshot(["a@x.org", "refused@x.org", "b@x.org"]),
+        smtp_host=smtp_sink.host,
+        smtp_port=smtp_sink.port,
+        use_tls=False,
+        delay=0,
+        dry_run=False,
+        index_fname=index,
+    )
+    keys = utils.read_key_index(index)
+    assert keys == {utils.recipient_key("a@x.org"), utils.recipient_key("b@x.org")}
+    # The refused recipient is sent to again by the next delta run
+    assert utils.delta_recipients(
+        snapshot(["a@x.org", "refused@x.org"]), keys
+    )["email"].tolist() == ["refused@x.org"]
+
+
+def run(campaign, *args):
+    cmd = [sys.executable, utils.__file__, *args]
+    return subprocess.run(cmd, cwd=campaign, capture_output=True, text=True, timeout=120)
+
+
+def test_delta_run_sends_only_new_recipients(campaign, smtp_sink):
+    smtp = ["--smtp-host", smtp_sink.host, "--smtp-port", str(smtp_sink.port), "--no-tls"]
+    assert run(campaign, "--delta", "welcome.keys", "--mark-sent", *smtp).returncode == 0
+    assert smtp_sink.messages == []
+    assert len(utils.read_key_index(str(campaign / "welcome.keys"))) == 30
+
+    with open(campaign / "recipients.csv", "a", encoding="utf-8") as f:
+        f.write("new1@example.org,New 1\nUSER3@example.org,User 3\nnew2@example.org,New 2\n")
+    assert run(campaign, "--delta", "welcome.keys", *smtp).returncode == 0
+    sent = sorted(rcpt for rcpts, _ in smtp_sink.messages for rcpt in rcpts)
+    assert sent == ["new1@example.org", "new2@example.org"]
+
+    assert run(campaign, "--delta", "welcome.keys", *smtp).returncode == 0
+    assert len(smtp_sink.messages) == 2
+
+
+def test_mark_sent_requires_delta(campaign, smtp_sink):
+    smtp = ["--smtp-host", smtp_sink.host, "--smtp-port", str(smtp_sink.port), "--no-tls"]
+    proc = run(campaign, "--mark-sent", *smtp)
+    assert proc.returncode == 2
+    assert "--mark-sent requires --delta" in proc.stderr
+    assert smtp_sink.messages == []
@@ -0,0 +1,124 @@
+import importlib
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+import bulk_mail_utils as utils
+
+# Peak traced memory per 1000 messages sent, well above what a run of
+# personalised messages needs when each message is sent as soon as it is built.
+MAX_PEAK_PER_1K = 8 * 1024 * 1024
+
+
+def profile_run(tmp_path, smtp_sink, n: int, refused: int = 0) -> dict:
+    emails = [f"user{i}@example.org" for i in range(n - refused)]
+    emails += [f"refused{i}@example.org" for i in range(refused)]
+    df = pd.DataFrame({"email": emails, "name": [f"User {i}" for i in range(n)]})
+    tpl = tmp_path / "welcome.html"
+    tpl.write_text("<p>Dear ${name},</p><p>" + "x" * 20_000 + "</p>", encoding="utf-8")
+    smtp_sink.keep_data = False  # The server runs in this process
+
+    profile = utils.start_profile()
+    utils.send_bulk_emails(
+        str(tpl),
+        df,
+        login_id="sender@example.org",
+        smtp_host=smtp_sink.host,
+        smtp_port=smtp_sink.port,
+        use_tls=False,
+        delay=0,
+        dry_run=False,
+        profile=profile,
+    )
+    return utils.stop_profile(profile, str(tmp_path / f"profile{n}"))
+
+
+def test_profile_reports_stages_and_files(tmp_path, smtp_sink):
+    summary = profile_run(tmp_path, smtp_sink, 50, refused=5)
+    assert summary["messages"] == 45  # Refused recipients are not counted
+    assert {"read", "render", "build", "send"} <= set(summary["stages"])
+    assert summary["stages"]["render"]["calls"] == 50
+    assert (tmp_path / "profile50.pstats").is_file()
+    assert "Top 20 allocation sites" in (tmp_path / "profile50_memory.txt").read_text()
+
+
+def test_peak_memory_per_message_does_not_grow(tmp_path, smtp_sink):
+    small = profile_run(tmp_path, smtp_sink, 100)
+    large = profile_run(tmp_path, smtp_sink, 400)
+    assert large["peak_bytes_per_1k"] < MAX_PEAK_PER_1K
+    # The per-1k figure falls with more messages even if memory grows
+    # linearly, so compare the peaks themselves.
+    assert large["peak_bytes"] < 1.5 * small["peak_bytes"]
+
+
+def test_threshold_fails_when_nothing_is_sent(campaign):
+    # Without credentials and without --no-tls nothing is sent
+    cmd = [sys.executable, utils.__file__, "--profile", "run", "--max-kib-per-1k", "100000"]
+    proc = subprocess.run(cmd, cwd=campaign, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 1
+    assert "No messages were sent" in proc.stdout
+
+
+def test_profile_does_not_change_the_selection(campaign, smtp_sink):
+    cmd = [sys.executable, utils.__file__, "--profile", "run", "--no-tls"]
+    cmd += ["--smtp-host", smtp_sink.host, "--smtp-port", str(smtp_sink.port)]
+    proc = subprocess.run(cmd, cwd=campaign, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0
+    # Only row 4, as without --profile
+    assert [rcpts for rcpts, _ in smtp_sink.messages] == [["user3@example.org"]]
+    assert (campaign / "run.pstats").is_file()
+
+
+class FakeSMTP:
+    sent = []
+
+    def __init__(self, host, port):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, login_id, pwd):
+        pass
+
+    def send_message(self, msg):
+        FakeSMTP.sent.append(msg["To"])
+
+
+def test_send_smtp_profile(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # bulk_email reads meeting_link.html on import
+    (tmp_path / "meeting_link.html").write_text("<p>Dear ${name}</p>", encoding="utf-8")
+    bulk_email = importlib.import_module("bulk_email")
+    monkeypatch.setattr(bulk_email.smtplib, "SMTP", FakeSMTP)
+    FakeSMTP.sent = []
+
+    profile = utils.start_profile()
+    xlsx = Path(utils.__file__).parent / "contactlists" / "test_recipients.xlsx"
+    recipients = bulk_email.prepare_recipients_list_from_excel(str(xlsx), profile)
+    bulk_email.send_smtp(
+        "localhost",
+        25,
+        "sender@example.org",
+        "",
+        "Sender",
+        recipients,
+        "Test",
+        bulk_email.html_template,
+        sleep_sec=0,
+        dry_run=False,
+        profile=profile,
+    )
+    summary = utils.stop_profile(profile, str(tmp_path / "bulk_email"))
+    assert summary["messages"] == len(FakeSMTP.sent) == len(recipients)
+    assert {"read", "clean", "render", "build", "send"} <= set(summary["stages"])
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import bulk_mail_utils as utils
+
+
+def test_aliases_map_to_canonical_columns():
+    df = pd.DataFrame(columns=["Timestamp", "Email Address", "Full Name"])
+    assert list(utils.canonical_columns(df).columns) == ["Timestamp", "email", "name"]
+
+
+def test_exact_canonical_column_wins_over_alias():
+    df = pd.DataFrame({"Email": ["a@x.org"], "email": ["b@x.org"], "name": ["B"]})
+    out = utils.canonical_columns(df)
+    assert out.columns.is_unique
+    assert out["email"].tolist() == ["b@x.org"]
+
+
+def test_single_file_with_aliased_headers(tmp_path):
+    fname = tmp_path / "form.csv"
+    fname.write_text("Timestamp,Email Address,Full Name\nt,a@x.org,A\n", encoding="utf-8")
+    df = utils.read_recipients_data(str(fname), usecols=["email", "name"])
+    assert df.to_dict("records") == [{"email": "a@x.org", "name": "A"}]
+    with pytest.raises(ValueError):
+        utils.read_recipients_data(str(fname), usecols=["email", "phone"])
+
+
+def test_sources_are_merged_and_deduplicated(tmp_path):
+    (tmp_path / "a.csv").write_text(
+        "Email,email,name\nx@x.org,a@x.org,A\nx@x.org,b@x.org,B\n", encoding="utf-8"
+    )
+    (tmp_path / "b.csv").write_text(
+        "E-mail,Full Name\n A@X.org ,A again\nc@x.org,C\n", encoding="utf-8"
+    )
+    df = utils.read_recipients_data(
+        str(tmp_path / "*.csv"), usecols=["email", "name"], cols_dup=[], cols_sort=[]
+    )
+    assert df["email"].tolist() == ["a@x.org", "b@x.org", "c@x.org"]
+    assert [s.rsplit("/", 1)[-1] for s in df["source"]] == ["a.csv", "a.csv", "b.csv"]
+
+
+@pytest.mark.parametrize("usecols", [["email", "name"], None])
+def test_source_without_email_column_is_an_error(tmp_path, usecols):
+    (tmp_path / "a.csv").write_text("email,name\na@x.org,A\n", encoding="utf-8")
+    (tmp_path / "b.csv").write_text(
+        "E-mail address,name\nb@x.org,B\nc@x.org,C\n", encoding="utf-8"
+    )
+    sources = [str(tmp_path / "a.csv"), str(tmp_path / "b.csv")]
+    with pytest.raises(ValueError, match=r"\['email'\] not found in .*b\.csv"):
+        utils.read_recipients_data(sources, usecols=usecols)
+
+
+def test_source_missing_a_usecols_column_is_an_error(tmp_path):
+    (tmp_path / "a.csv").write_text("email,name,phone\na@x.org,A,1\n", encoding="utf-8")
+    (tmp_path / "b.csv").write_text("email,name\nb@x.org,B\n", encoding="utf-8")
+    with pytest.raises(ValueError, match=r"\['phone'\] not found in .*b\.csv"):
+        utils.read_recipients_data(
+            str(tmp_path / "*.csv"), usecols=["email", "name", "phone"]
+        )
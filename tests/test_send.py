@@ -0,0 +1,91 @@
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+import bulk_mail_utils as utils
+
+
+def recipients(n: int, refused: int = 0) -> pd.DataFrame:
+    emails = [f"user{i}@example.org" for i in range(n - refused)]
+    emails += [f"refused{i}@example.org" for i in range(refused)]
+    return pd.DataFrame({"email": emails, "name": [f"User {i}" for i in range(n)]})
+
+
+def send(smtp_sink, tpl_fname, df, **kwargs):
+    utils.send_bulk_emails(
+        str(tpl_fname),
+        df,
+        sender_name="Sender",
+        login_id="sender@example.org",
+        subject="Test",
+        smtp_host=smtp_sink.host,
+        smtp_port=smtp_sink.port,
+        use_tls=False,
+        delay=0,
+        dry_run=False,
+        **kwargs,
+    )
+
+
+def test_identical_messages_are_batched(tmp_path, smtp_sink):
+    tpl = tmp_path / "announce.md"
+    tpl.write_text("Hello all, the meeting is on Monday.\n", encoding="utf-8")
+    ledger = tmp_path / "ledger.csv"
+    send(smtp_sink, tpl, recipients(25, refused=1), batch_size=10, ledger_fname=str(ledger))
+
+    assert [len(rcpts) for rcpts, _ in smtp_sink.messages] == [10, 10, 4]
+    assert all(b"To: Sender <sender@example.org>" in data for _, data in smtp_sink.messages)
+    status = pd.read_csv(ledger)["status"].value_counts().to_dict()
+    assert status == {"sent": 24, "error": 1}
+
+
+def test_personalised_messages_are_not_batched(tmp_path, smtp_sink):
+    tpl = tmp_path / "welcome.md"
+    tpl.write_text("Dear ${name},\n", encoding="utf-8")
+    send(smtp_sink, tpl, recipients(5), batch_size=10)
+
+    assert [rcpts for rcpts, _ in smtp_sink.messages] == [
+        [f"user{i}@example.org"] for i in range(5)
+    ]
+
+
+def peak_memory(smtp_sink, tpl_fname, n: int, batch_size: int = 1) -> int:
+    df = recipients(n)
+    tracemalloc.start()
+    try:
+        send(smtp_sink, tpl_fname, df, batch_size=batch_size)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("batch_size", [1, 10])
+def test_memory_does_not_grow_with_recipients(tmp_path, smtp_sink, batch_size):
+    tpl = tmp_path / "large.html"
+    tpl.write_text("<p>Dear ${name},</p>" + "<p>" + "x" * 50_000 + "</p>", encoding="utf-8")
+    smtp_sink.keep_data = False  # The server runs in this process
+    small = peak_memory(smtp_sink, tpl, 100, batch_size)
+    large = peak_memory(smtp_sink, tpl, 400, batch_size)
+    assert large < 1.5 * small
+
+
+def test_personalised_batches_stream_in_order():
+    rendered = []
+
+    def render(i):
+        rendered.append(i)
+        return f"Dear {i}"
+
+    batches = utils.batch_identical(range(1000), render, batch_size=10)
+    assert next(batches) == ("Dear 0", [0])
+    assert len(rendered) == 10
+    assert [rows for _, rows in batches] == [[i] for i in range(1, 1000)]
+
+
+def test_few_distinct_bodies_still_fill_batches():
+    rows = [i % 2 for i in range(40)]
+    batches = list(utils.batch_identical(rows, str, batch_size=10))
+    assert sum(len(rows) for _, rows in batches) == 40
+    assert all(len(set(rows)) == 1 for _, rows in batches)
+    assert len(batches) <= 8
@@ -0,0 +1,73 @@
+import pandas as pd
+
+import bulk_mail_utils as utils
+
+
+def recipients(n: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "email": [f"user{i}@example.org" for i in range(n)],
+            "name": [f"User {i}" for i in range(n)],
+        }
+    )
+
+
+def run(job: dict) -> dict:
+    while not job["done"]:
+        utils.poll_send_job(job, timeout=1)
+    return job
+
+
+def test_dry_run_counts_previewed_not_sent():
+    job = run(utils.start_send_job(recipients(10), lambda row: "x", start=3, count=5))
+    assert (job["total"], job["previewed"], job["sent"], job["failed"]) == (5, 5, 0, 0)
+    assert [r["row"] for r in job["results"]] == [3, 4, 5, 6, 7]
+
+
+def test_job_uses_ledger_index_and_batching(tmp_path, smtp_sink):
+    ledger, index = tmp_path / "ledger.csv", tmp_path / "sent.keys"
+    job = utils.start_send_job(
+        recipients(6),
+        lambda row: "Same for everyone",
+        smtp_host=smtp_sink.host,
+        smtp_port=smtp_sink.port,
+        use_tls=False,
+        delay=0,
+        dry_run=False,
+        ledger_fname=str(ledger),
+        index_fname=str(index),
+        batch_size=4,
+    )
+    run(job)
+    assert (job["sent"], job["failed"], job["error"]) == (6, 0, "")
+    assert [len(rcpts) for rcpts, _ in smtp_sink.messages] == [4, 2]
+    assert len(pd.read_csv(ledger)) == 6
+    assert len(utils.read_key_index(str(index))) == 6
+
+
+def test_cancel_stops_job(smtp_sink):
+    job = utils.start_send_job(
+        recipients(50),
+        lambda row: f"Dear {row['name']}",
+        smtp_host=smtp_sink.host,
+        smtp_port=smtp_sink.port,
+        use_tls=False,
+        delay=0.2,
+        dry_run=False,
+    )
+    assert utils.send_job_running(job)
+    utils.poll_send_job(job, timeout=5)
+    utils.cancel_send_job(job)
+    run(job)
+    job["thread"].join(timeout=5)
+    assert not utils.send_job_running(job)
+    assert 0 < job["sent"] < 50
+
+
+def test_connection_error_is_reported():
+    job = utils.start_send_job(
+        recipients(2), lambda row: "x", smtp_host="127.0.0.1", smtp_port=1, dry_run=False
+    )
+    run(job)
+    assert job["error"].startswith("Sending stopped")
+    assert job["results"] == []
@@ -0,0 +1,78 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import bulk_mail_utils as utils
+
+SCRIPT = Path(utils.__file__).resolve()
+
+
+def test_shards_are_disjoint_and_stable():
+    emails = [f"user{i}@example.org" for i in range(100)]
+    df = utils.pd.DataFrame({"email": emails, "name": emails})
+    shards = utils.plan_shards(df, 3)
+    assert sum(len(shard) for shard in shards) == len(df)
+    assert set().union(*(set(shard["email"]) for shard in shards)) == set(emails)
+    # Case and surrounding spaces do not move a recipient to another shard
+    assert utils.shard_of(" User1@Example.org", 3) == utils.shard_of("user1@example.org", 3)
+
+
+def test_parallel_shards_merge_without_gaps(campaign, smtp_sink):
+    cmd = [sys.executable, str(SCRIPT), "--smtp-host", smtp_sink.host]
+    cmd += ["--smtp-port", str(smtp_sink.port), "--no-tls"]
+    procs = [
+        subprocess.Popen(cmd + ["--shard", f"{i}/2"], cwd=campaign, stdout=subprocess.DEVNULL)
+        for i in (1, 2)
+    ]
+    assert [proc.wait(timeout=120) for proc in procs] == [0, 0]
+
+    ledgers = [str(campaign / f"ledger_shard{i}of2.csv") for i in (1, 2)]
+    recipients = utils.read_recipients_data("recipients.csv", cols_dup=[], cols_sort=[])
+    report, duplicates, gaps = utils.merge_ledgers(ledgers, recipients)
+    assert len(smtp_sink.messages) == 30
+    assert len(report) == 30
+    assert duplicates.empty
+    assert gaps.empty
+
+
+def test_merge_reports_duplicates_and_gaps(campaign, smtp_sink):
+    df = utils.read_recipients_data("recipients.csv", cols_dup=[], cols_sort=[])
+    shard1, shard2 = utils.plan_shards(df, 2)
+    for _ in range(2):  # Shard 1 sent twice, shard 2 never
+        utils.send_bulk_emails(
+            "welcome.md",
+            shard1,
+            smtp_host=smtp_sink.host,
+            smtp_port=smtp_sink.port,
+            use_tls=False,
+            delay=0,
+            dry_run=False,
+            ledger_fname="ledger.csv",
+        )
+    _, duplicates, gaps = utils.merge_ledgers(["ledger.csv"], df)
+    assert duplicates["key"].nunique() == len(shard1)
+    assert set(gaps["email"]) == set(shard2["email"])
+
+
+def test_merge_keeps_last_entry_within_the_same_second(tmp_path):
+    # An error followed by a successful retry, all logged in the same second
+    lines = ["time,shard,key,email,name,status,error"]
+    for i in range(50):
+        key = utils.recipient_key(f"user{i}@example.org")
+        lines.append(f"2026-03-14 10:00:00,,{key},user{i}@example.org,U,error,timeout")
+        lines.append(f"2026-03-14 10:00:00,,{key},user{i}@example.org,U,sent,")
+    ledger = tmp_path / "ledger.csv"
+    ledger.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    report, duplicates, _ = utils.merge_ledgers([str(ledger)])
+    assert len(report) == 50
+    assert set(report["status"]) == {"sent"}
+    assert duplicates.empty
+
+
+def test_ledger_times_have_sub_second_resolution(tmp_path):
+    ledger = tmp_path / "ledger.csv"
+    row = utils.pd.Series({"email": "a@example.org", "name": "A"})
+    utils.append_ledger(str(ledger), row, "error", "timeout")
+    utils.append_ledger(str(ledger), row, "sent")
+    times = utils.pd.read_csv(ledger)["time"].tolist()
+    assert times[0] < times[1]